@@ -129,6 +129,5 @@ if common_gdbs:
     else:
         print('No geodatabases to compare.')
 
-sys.stdout = sys.__stdout__
 print('\nDirectory comparison completed at: ', dt.now())
 print(">>>> DONE >>>>")
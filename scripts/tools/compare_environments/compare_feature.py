@@ -8,29 +8,27 @@
 # ================================================================================================================
 
 import traceback
+import logging
 import os
 import arcpy as ap
 import pandas as pd
 import numpy as np
 import more_itertools as mit
 from collections import defaultdict
-import xlsxwriter
 import xlwt
+# report writing lives in a module of its own, free of arcpy, so the worker processes compile_report starts (and
+# scripts that only convert results) do not import arcpy
+from report_writer import compile_report, split_dataframe
 
-def split_dataframe(df, chunk_size=1000000):
-    """Split large dataframes into smaller chunks so that they can be exported to Excel.
-    \nParameters:
-    \tdf (dataframe): dataframe to be split
-    \nchunk_size (int): the number of records to split off into each chunk
-    \nReturns:
-    \tchunks (list): list of dataframes (chunks)"""
-    chunks = list()
-    num_chunks = df.shape[0] // chunk_size + 1
-    for i in range(num_chunks):
-        chunks.append(df[i*chunk_size:(i+1)*chunk_size])
-    for n, chunk in enumerate(chunks):
-        chunk.name = df.name + '_' + str(n + 1)
-    return chunks
+# GDAL-based reader used for bulk attribute reads from file geodatabases when installed; much faster than arcpy
+try:
+    import pyogrio
+    from pyogrio.errors import DataLayerError, DataSourceError
+except ImportError:
+    pyogrio = None
+
+# findings are logged here; compare_gdb writes them to a log file for each geodatabase comparison
+logger = logging.getLogger('compare_environments')
 
 
 def trunc_xlsx_sheet_name(name):
@@ -100,18 +98,18 @@ def dataframe_compare(df_list):
                 base_only_ppid = set(base_ppid).difference(set(test_ppid))
                 test_only_ppid = set(test_ppid).difference(set(base_ppid))
                 if len(base_ppid) != len(test_ppid):
-                    print('\tThere are {} PROJPOLYID(s) from {} in base feature.'.format(
+                    logger.info('\tThere are {} PROJPOLYID(s) from {} in base feature.'.format(
                         len(base_ppid), combined_df.name))
-                    print('\tThere are {} PROJPOLYID(s) from {} in test feature.'.format(
+                    logger.info('\tThere are {} PROJPOLYID(s) from {} in test feature.'.format(
                         len(test_ppid), combined_df.name))
                 if base_only_ppid:
-                    print('\t{} PROJPOLYID(s) from {} found only in base feature: {}. \n\t Dropping to facilitate comparison.'.format(len(base_only_ppid), combined_df.name,
-                                                                                                                                    sorted(base_only_ppid)))
+                    logger.info('\t{} PROJPOLYID(s) from {} found only in base feature: {}. \n\t Dropping to facilitate comparison.'.format(len(base_only_ppid), combined_df.name,
+                                                                                                                                          sorted(base_only_ppid)))
                     combined_df = combined_df[~combined_df['PROJPOLYID_b'].isin(base_only_ppid)]
                     combined_df.name = str(df_list[0].name)                                                                                                                
                 if test_only_ppid:
-                    print('\t{} PROJPOLYID(s) from {} found only in test feature: {}. Dropping to facilitate comparison.'.format(len(test_only_ppid), combined_df.name,
-                                                                                                                                sorted(test_only_ppid)))
+                    logger.info('\t{} PROJPOLYID(s) from {} found only in test feature: {}. Dropping to facilitate comparison.'.format(len(test_only_ppid), combined_df.name,
+                                                                                                                                      sorted(test_only_ppid)))
                     combined_df = combined_df[~combined_df['PROJPOLYID_t'].isin(test_only_ppid)]
                     combined_df.name = str(df_list[0].name)
         
@@ -133,7 +131,7 @@ def dataframe_compare(df_list):
                     duplicates.name = trunc_xlsx_sheet_name(
                         combined_df.name + '_test_dup')
                     return_list.append(duplicates)
-                    print('\tDuplicates found in {}. See Excel report.'.format(
+                    logger.info('\tDuplicates found in {}. See Excel report.'.format(
                         feature_list[1]))
         
         # for records found in both features, split back out to base and test
@@ -156,7 +154,7 @@ def dataframe_compare(df_list):
                 if drop_ne:
                     col_dict['all_vals_mismatched'] = drop_ne
                     if not bapid_check:
-                        print(
+                        logger.info(
                             '\n\tDropping columns where all values are mismatched to facilitate comparison. See Excel report.')
                 # find columns where all values match
                 drop_eq = [
@@ -199,7 +197,7 @@ def dataframe_compare(df_list):
                                             for group in mit.consecutive_groups(consec_count.index)]
 
                             for i in (i for i in index_groups if consec_count[i].sum() >= 50000):
-                                print(
+                                logger.info(
                                     """\tA run of over 50,000 attributes in consecutive records in {} 
                                     was mismatched. This usually indicates a departure in correlation between the rows
                                     of the features being compared. Records not exported to Excel.""".format(combined_df.name))
@@ -212,7 +210,7 @@ def dataframe_compare(df_list):
                                             for group in mit.consecutive_groups(consec_count.index)]
 
                             for i in (i for i in index_groups if consec_count[i].sum() >= 50000):
-                                print(
+                                logger.info(
                                     """\tA run of over 50,000 attributes in consecutive records, from OBJECTID {} to {}, 
                                     was mismatched. This usually indicates a departure in correlation between the OBJECTIDs
                                     of the features being compared. Records not exported to Excel.""".format(i[0], i[-1]))
@@ -244,10 +242,10 @@ def dataframe_compare(df_list):
                         simp_df.name = trunc_xlsx_sheet_name(
                             combined_df.name + '_att')
                         return_list.append(simp_df)
-                        print(
+                        logger.info(
                             '\tMismatched attributes still found for {} after dropping columns. See Excel report.'.format(combined_df.name))
         else:
-            print('\tNo matching OBJECTIDs to compare.')
+            logger.info('\tNo matching OBJECTIDs to compare.')
 
         if return_list:
             return return_list
@@ -255,11 +253,53 @@ def dataframe_compare(df_list):
             return None
 
     except Exception as e:
-        print('\tSomething went wrong during the attribute comparison for {}. \n\t{}. \n\tSkipping to next BAPID or feature.'.format(
+        logger.info('\tSomething went wrong during the attribute comparison for {}. \n\t{}. \n\tSkipping to next BAPID or feature.'.format(
             combined_df.name, traceback.format_exc()))
         pass
 
 
+def read_attributes(feature, fields, null_dict):
+    """Read the attribute table of a geodatabase feature into a dataframe indexed by its OID field, filling nulls.
+    Features in a file geodatabase are read with pyogrio when it is installed and exposes every field, otherwise
+    (or if pyogrio cannot open the feature) they are read with arcpy.
+    \nParameters:
+    \tfeature (str): path of feature class or table
+    \tfields (list): arcpy field objects to read, including the OID field and excluding geometry
+    \tnull_dict (dict): value to fill nulls with, by field name
+    \nReturns:
+    \tdf (dataframe): attribute table"""
+    oid = [f.name for f in fields if f.type == 'OID'][0]
+    field_names = [f.name for f in fields]
+
+    gdb_end = feature.lower().find('.gdb')
+    if pyogrio is not None and gdb_end > -1:
+        # feature datasets are not part of OGR layer names
+        gdb = feature[:gdb_end + 4]
+        layer = os.path.basename(os.path.normpath(feature))
+        read_fields = [f.name for f in fields if f.type != 'OID']
+        try:
+            if set(read_fields).issubset(pyogrio.read_info(gdb, layer=layer)['fields']):
+                df = pyogrio.read_dataframe(gdb, layer=layer, columns=read_fields, read_geometry=False,
+                                            fid_as_index=True)
+                for f in fields:
+                    if f.name in null_dict and f.type != 'OID':
+                        fill = pd.Timestamp(null_dict[f.name]) if f.type == 'Date' else null_dict[f.name]
+                        df[f.name] = df[f.name].fillna(fill)
+                        # integer columns holding nulls are read as floats
+                        if f.type in ['Integer', 'SmallInteger']:
+                            df[f.name] = df[f.name].astype('int32' if f.type == 'Integer' else 'int16')
+                df.index.name = oid
+                return df[[n for n in field_names if n != oid]].sort_index()
+        except (DataSourceError, DataLayerError):
+            pass
+
+    if ap.Describe(feature).datasetType == 'FeatureClass':
+        arr = ap.da.FeatureClassToNumPyArray(feature, field_names, null_value=null_dict)
+    else:
+        arr = ap.da.TableToNumPyArray(feature, field_names, null_value=null_dict)
+    return pd.DataFrame(arr).set_index(oid).sort_index()
+
+
 def attributes_compare(feature_list):
     """Given a list containing the paths of two identically named geodatabase features (ie. feature class, table), 
     perform high-level comparison of their attributes and set up dataframes for more detailed comparison with dataframe_compare function.
@@ -267,9 +307,11 @@ def attributes_compare(feature_list):
     \nParameters:
     \tfeature_list (list): list of paths. eg. [r'X:\TEIS_Env_Master\Operational_Data.gdb\TEIS_Master_Short_Tbl', r'X:\Deliverables\Operational_Data.gdb\TEIS_Master_Short_Tbl']
     \nReturns:
-    \n\treturn_list (list): list of dataframes"""
+    \n\treturn_list (list): list of dataframes
+    \nRaises:
+    \n\tany error raised while reading or comparing the attributes, after logging its traceback"""
     try:
-        print('\tComparing attributes...')
+        logger.info('\tComparing attributes...')
         feature_name = os.path.basename(os.path.normpath(feature_list[0]))
         df_list = []
         return_list = []
@@ -281,22 +323,15 @@ def attributes_compare(feature_list):
 
         for feature in feature_list:
             # assign null fill types based on data type of field
-            null_dict = {f.name: null_types[f.type] for f in ap.ListFields(
-                feature) if f.type in null_types}
-            for f in ap.ListFields(feature):
-                if f.type == 'OID':
-                    oid = f.name
+            fields = ap.ListFields(feature)
+            null_dict = {f.name: null_types[f.type] for f in fields if f.type in null_types}
 
             # read in attribute table (omitting geometry as these are read as tuples and will cause error)
-            if ap.Describe(feature).datasetType == 'FeatureClass':
-                df = pd.DataFrame(ap.da.FeatureClassToNumPyArray(feature, [f.name for f in ap.ListFields(feature) if f.name not in ['Shape', 'SHAPE', 'Geometry', 'GEOMETRY']],
-                                                                 null_value=null_dict)).set_index(oid).sort_index()
-            elif ap.Describe(feature).datasetType == 'Table':
-                df = pd.DataFrame(ap.da.TableToNumPyArray(feature, [f.name for f in ap.ListFields(feature) if f.name not in ['Shape', 'SHAPE', 'Geometry', 'GEOMETRY']],
-                                                          null_value=null_dict)).set_index(oid).sort_index()
+            df = read_attributes(feature, [f for f in fields if f.name not in ['Shape', 'SHAPE', 'Geometry', 'GEOMETRY']],
+                                 null_dict)
             # if dataframe is empty, exit
             if df.shape[0] == 0:
-                print('\t{} is empty. Ending attribute comparison.'.format(feature))
+                logger.info('\t{} is empty. Ending attribute comparison.'.format(feature))
                 return
             else:
                 row_count.append(df.shape[0])
@@ -309,8 +344,8 @@ def attributes_compare(feature_list):
             null_cols = [col for col in df.columns if df[col].isna(
             ).all() or df[col].isin(null_types.values()).all()]
             if null_cols:
-                print('\tAll values are null in columns {} in {}. \n\tDropping from both features to facilitate comparison.'
-                      .format(sorted(null_cols), feature))
+                logger.info('\tAll values are null in columns {} in {}. \n\tDropping from both features to facilitate comparison.'
+                            .format(sorted(null_cols), feature))
                 nulls_set.update(null_cols)
 
             # alter data types to decrease memory demand
@@ -334,8 +369,8 @@ def attributes_compare(feature_list):
                 missing_dict[feature] = [
                     list(group) for group in mit.consecutive_groups(insert_dummy_rows(uids))]
 
-        print('\t{} records in base.'.format(row_count[0]))
-        print('\t{} records in test.'.format(row_count[1]))
+        logger.info('\t{} records in base.'.format(row_count[0]))
+        logger.info('\t{} records in test.'.format(row_count[1]))
 
         # drop nulls
         for df in df_list:
@@ -358,14 +393,14 @@ def attributes_compare(feature_list):
             for v in missing_match:
                 missing_dict[feature_list[0]].remove(v)
                 missing_dict[feature_list[1]].remove(v)
-                print('\tOBJECTIDs {} to {} are missing from both feature classes. No need for dummy rows'.format(
+                logger.info('\tOBJECTIDs {} to {} are missing from both feature classes. No need for dummy rows'.format(
                     min(v), max(v)))
 
         # insert dummy rows into dataframe(s) for missing unique IDs
         for x in range(2):
             if feature_list[x] in missing_dict and missing_dict[feature_list[x]] != []:
                 for v in missing_dict[feature_list[x]]:
-                    print('\tOBJECTIDs {} to {} are missing from {}. Adding dummy rows to facilitate comparison.'.format(
+                    logger.info('\tOBJECTIDs {} to {} are missing from {}. Adding dummy rows to facilitate comparison.'.format(
                         min(v), max(v), feature_list[x]))
                 dummy_rows = [val for sublist in missing_dict[feature_list[x]]
                               for val in sublist]
@@ -392,16 +427,16 @@ def attributes_compare(feature_list):
             base_only_bapids = set(base_bapids).difference(set(test_bapids))
             test_only_bapids = set(test_bapids).difference(set(base_bapids))
             if len(base_bapids) != len(test_bapids):
-                print('\tThere are {} BAPIDs in base feature.'.format(
+                logger.info('\tThere are {} BAPIDs in base feature.'.format(
                     len(base_bapids)))
-                print('\tThere are {} BAPIDs in test feature.'.format(
+                logger.info('\tThere are {} BAPIDs in test feature.'.format(
                     len(test_bapids)))
             if base_only_bapids:
-                print('\t{} BAPID(s) found only in base feature: {}'.format(len(base_only_bapids),
-                                                                            sorted(base_only_bapids)))
+                logger.info('\t{} BAPID(s) found only in base feature: {}'.format(len(base_only_bapids),
+                                                                                  sorted(base_only_bapids)))
             if test_only_bapids:
-                print('\t{} BAPID(s) found only in test feature: {}'.format(len(test_only_bapids),
-                                                                            sorted(test_only_bapids)))
+                logger.info('\t{} BAPID(s) found only in test feature: {}'.format(len(test_only_bapids),
+                                                                                  sorted(test_only_bapids)))
 
             # group dataframes by BAPID
             base_g = df_list[0].groupby(bapid)
@@ -444,7 +479,7 @@ def attributes_compare(feature_list):
                         'BAPID'].apply(', '.join).reset_index()
                     cols.name = trunc_xlsx_sheet_name(feature_name + '_cols')
                     return_list.append(cols)
-                    print(
+                    logger.info(
                         '\tDropped columns where all values are mismatched to facilitate comparison. See Excel report.')
                 att_list = [df for df in processed_bapids if '_att' in df.name]
                 if att_list:
@@ -452,7 +487,7 @@ def attributes_compare(feature_list):
                     att.name = trunc_xlsx_sheet_name(feature_name + '_att')
                     return_list.append(att)
                 else:
-                    print('\tAttributes match.')
+                    logger.info('\tAttributes match.')
 
             if return_list:
                 return return_list
@@ -464,16 +499,17 @@ def attributes_compare(feature_list):
             result = dataframe_compare(df_list)
             if result is not None:
                 if not any('_att' in df.name for df in result):
-                    print('\tAttributes match.')
+                    logger.info('\tAttributes match.')
                 return result
             elif result is None:
-                print('\tAttributes match.')
+                logger.info('\tAttributes match.')
                 return None
 
-    except Exception as e:
-        print('\tSomething went wrong setting up the attribute comparison for {}. \n\t{}. \n\tSkipping to next feature.'.format(
+    except Exception:
+        # the error is passed on so the caller can record which features failed
+        logger.info('\tSomething went wrong setting up the attribute comparison for {}. \n\t{}.'.format(
             feature_name, traceback.format_exc()))
-        pass
+        raise
 
 
 def schema_compare(feature_list):
@@ -553,25 +589,8 @@ def sr_compare(feature_list):
         sr_list.append(sr.name)
 
     if sr_list[0] == sr_list[1]:
-        return print('\tSpatial references match. {} for both feature classes.'
-                     .format(sr_list[0]))
+        return logger.info('\tSpatial references match. {} for both feature classes.'
+                           .format(sr_list[0]))
     elif sr_list[0] != sr_list[1]:
-        return print('\tSpatial references do not match. {} for {} and {} for {}'
-                     .format(sr_list[0], feature_list[0], sr_list[1], feature_list[1]))
-
-
-def compile_report(env_name, df_list, out_dir):
-    """Export dataframes to separate sheets in an Excel workbook.
-    \nParameters:
-    \tenv_name (str): Name of environment (geodatabase) being evaluated. eg. 'Operational_Data'
-    \tdf_list (list): list of dataframes to export
-    \tout_dir (str): path of location to save Excel file"""
-
-    writer = pd.ExcelWriter(os.path.join(
-        out_dir, env_name + '_comparison_rpt.xlsx'), engine='xlsxwriter', date_format='YYYY-MM-DD')
-
-    for df in df_list:
-        df.to_excel(writer, sheet_name=df.name)
-
-    writer.book.use_zip64()
-    writer.save()
+        return logger.info('\tSpatial references do not match. {} for {} and {} for {}'
+                           .format(sr_list[0], feature_list[0], sr_list[1], feature_list[1]))
@@ -10,19 +10,49 @@
 # ================================================================================================================
 
 import arcpy as ap
+import logging
 import os
-import sys
+import threading
+import traceback
 from compare_feature import *
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt
 
 
-def compare_gdb(gdb_list, output_loc):
+class _ThreadLogBuffer(logging.Filter):
+    """Hold back log records emitted by a thread between start() and stop(), so that they can be written together
+    rather than interleaved with other threads' records."""
+
+    def __init__(self):
+        super().__init__()
+        self.buffers = {}
+
+    def start(self):
+        self.buffers[threading.get_ident()] = []
+
+    def stop(self):
+        return self.buffers.pop(threading.get_ident())
+
+    def filter(self, record):
+        buffer = self.buffers.get(threading.get_ident())
+        if buffer is None:
+            return True
+        buffer.append(record)
+        return False
+
+
+def compare_gdb(gdb_list, output_loc, max_workers=1):
     """Given a list containing the paths of two identically named geodatabases, perform high-level comparison of their items
     and call functions from compare_feature.py to compare spatial reference, schema, and attributes of same-name items.
-    Shows findings with standard output stream (print or log) and calls compile_report to create an Excel file of results."
+    Logs findings and calls compile_report to create an Excel file of results."
     \nParameters:
     \tgdb_list (list): list of paths of gdbs to compare. eg. [r'X:\TEIS_Env_Master\Operational_Data.gdb', r'X:\Deliverables\Operational_Data.gdb']
-    \toutput_loc (path): the location to save Excel file and log"""
+    \toutput_loc (path): the location to save Excel file and log
+    \tmax_workers (int): number of feature classes to compare at the same time, each on its own thread. arcpy is not
+    \t\tthread-safe, so running its Describe, ListFields and cursor calls on several threads at once may fail or return
+    \t\twrong results; only raise this for gdbs where that has been tested. Default 1 (compare in the calling thread)
+    \nReturns:
+    \tfailed_fcs (list): names of feature classes and tables whose comparison failed"""
 
     ap.env.overwriteOutput = True
 
@@ -31,92 +61,133 @@ def compare_gdb(gdb_list, output_loc):
                  'GeometryErrors', 'RangeErrors', 'RowErrors', 'SummaryErrors']
 
     # create output directory
-    if os.path.basename(os.path.normpath(gdb_list[0])) == os.path.basename(os.path.normpath(gdb_list[1])):
-        gdb_name = os.path.basename(
-            os.path.normpath(gdb_list[0])).rstrip('.gdb')
-    elif os.path.basename(os.path.normpath(gdb_list[0])) != os.path.basename(os.path.normpath(gdb_list[1])):
-        gdb_name = os.path.basename(os.path.normpath(gdb_list[0])).rstrip('.gdb') + '_' + \
-            os.path.basename(os.path.normpath(gdb_list[1])).rstrip('.gdb')
+    # splitext removes only the .gdb extension (rstrip('.gdb') would also strip any trailing 'g', 'd' or 'b')
+    base_name, test_name = (os.path.splitext(os.path.basename(os.path.normpath(g)))[0] for g in gdb_list)
+    gdb_name = base_name if base_name == test_name else base_name + '_' + test_name
     out_dir = os.path.join(output_loc, gdb_name + '_Compare_Files')
     if not os.path.exists(out_dir):
         os.mkdir(out_dir)
 
-    # create log file and change system standard output to log instead of printing to console/terminal
-    log = open(os.path.join(out_dir, 'comparison_rpt.log'), 'w')
-    sys.stdout = log
-
-    print('\nCOMPARING {} to {}'.format(gdb_list[0], gdb_list[1]))
-    print('Started at: ', dt.now())
-
-    # create dictionaries for common items and unique items
-    all_items = []
-    for g in gdb_list:
-        ap.env.workspace = g
-        all_items.extend((ap.ListFeatureClasses(), ap.ListTables()))
-
-    common_dict = {'feature_classes': set(all_items[0]).intersection(set(all_items[2])),
-                   'tables': set(all_items[1]).intersection(set(all_items[3]))}
-
-    diff_dict = {gdb_list[0]: [set(all_items[0]).difference(set(all_items[2])),
-                               set(all_items[1]).difference(set(all_items[3]))],
-                 gdb_list[1]: [set(all_items[2]).difference(set(all_items[0])),
-                               set(all_items[3]).difference(set(all_items[1]))]}
-    for k, v in diff_dict.items():
-        print('\n\tFeatures classe(s) unique to {}: \n\t{}'.format(
-            k, v[0]) if len(v[0]) != 0 else '')
-        print('\n\tTable(s) unique to {}: \n\t{}'.format(
-            k, v[1]) if len(v[1]) != 0 else '')
-
-    # iterate through common feature classes and compare spatial reference, schema, and attributes
-    # (calling functions from compare_feature.py)
-    df_list = []
-    for fc in (fc for fc in sorted(common_dict['feature_classes']) if not any(o in fc for o in omit_list)):
-        print('\nComparing feature class: {}'.format(fc))
-        base_fc = gdb_list[0]+'\\'+fc
-        test_fc = gdb_list[1]+'\\'+fc
-        fc_list = [base_fc, test_fc]
-
-        sr_compare(fc_list)
-
-        schema_df = schema_compare(fc_list)
-        if schema_df is not None:
-            df_list.append(schema_df)
-            print('\tSchemas do not match. See Excel report.')
-        elif schema_df is None:
-            print('\tSchemas match.')
-        try:
-            attributes_dfs = attributes_compare(fc_list)
-            if attributes_dfs is not None:
-                df_list.extend(attributes_dfs)
-        except:
-            print('An ')
-            pass
-
-    # iterate through common tables and compare spatial reference, schema, and attributes
-    # (calling functions from compare_feature.py)
-    for table in (table for table in sorted(common_dict['tables']) if not any(o in table for o in omit_list)):
-        print('\nComparing table: {}'.format(table))
-        base_table = gdb_list[0]+'\\'+table
-        test_table = gdb_list[1]+'\\'+table
-        table_list = [base_table, test_table]
-
-        schema_df = schema_compare(table_list)
-        if schema_df is not None:
-            df_list.append(schema_df)
-            print('\tSchemas do not match. See Excel report.')
-        elif schema_df is None:
-            print('\tSchemas match.')
-
-        attributes_dfs = attributes_compare(table_list)
-        if attributes_dfs is not None:
-            df_list.extend(attributes_dfs)
-
-    print('\nGeodatabase comparison completed at: ', dt.now())
-
-    # export list of dataframes to Excel
-    if df_list:
-        to_export = [df for df in df_list if df.shape[0] <= 100000]
-        for df in (df for df in df_list if df.shape[0] > 100000):
-            to_export.extend(split_dataframe(df))
-        compile_report(gdb_name, to_export, out_dir)
-        print('Export completed at: ', dt.now())
+    # log findings (including those from compare_feature.py) to a file for this comparison only
+    log_handler = logging.FileHandler(os.path.join(out_dir, 'comparison_rpt.log'), mode='w')
+    logger.addHandler(log_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    log_buffer = _ThreadLogBuffer()
+    try:
+        logger.info('\nCOMPARING {} to {}'.format(gdb_list[0], gdb_list[1]))
+        logger.info('Started at: {}'.format(dt.now()))
+
+        # create dictionaries for common items and unique items
+        # feature classes are found with Walk so that those inside feature datasets are included (named relative to the
+        # gdb, eg. 'Dataset\FC'); tables can only sit at the root of a gdb
+        # names are collected straight into sets, which are reused for the intersections and differences
+        all_items = []
+        for g in gdb_list:
+            ap.env.workspace = g
+            fcs = {os.path.relpath(os.path.join(dirpath, filename), g)
+                   for dirpath, dirnames, filenames in ap.da.Walk(g, datatype='FeatureClass') for filename in filenames}
+            all_items.extend((fcs, set(ap.ListTables())))
+
+        base_fcs, base_tables, test_fcs, test_tables = all_items
+        common_dict = {'feature_classes': base_fcs & test_fcs,
+                       'tables': base_tables & test_tables}
+
+        diff_dict = {gdb_list[0]: [base_fcs - test_fcs, base_tables - test_tables],
+                     gdb_list[1]: [test_fcs - base_fcs, test_tables - base_tables]}
+        for k, v in diff_dict.items():
+            logger.info('\n\tFeatures classe(s) unique to {}: \n\t{}'.format(
+                k, v[0]) if len(v[0]) != 0 else '')
+            logger.info('\n\tTable(s) unique to {}: \n\t{}'.format(
+                k, v[1]) if len(v[1]) != 0 else '')
+
+        # iterate through common feature classes and compare spatial reference, schema, and attributes
+        # (calling functions from compare_feature.py). With max_workers > 1, feature classes are compared on a pool of
+        # threads so that reads from the two gdbs overlap; each one's log messages are held back and written in order
+        # once it is done. Otherwise they are compared one at a time in this thread (the pool then starts no threads).
+        def compare_fc(fc):
+            log_buffer.start()
+            fc_dfs = []
+            failed = False
+            try:
+                logger.info('\nComparing feature class: {}'.format(fc))
+                base_fc = gdb_list[0]+'\\'+fc
+                test_fc = gdb_list[1]+'\\'+fc
+                fc_list = [base_fc, test_fc]
+
+                sr_compare(fc_list)
+
+                schema_df = schema_compare(fc_list)
+                if schema_df is not None:
+                    fc_dfs.append(schema_df)
+                    logger.info('\tSchemas do not match. See Excel report.')
+                elif schema_df is None:
+                    logger.info('\tSchemas match.')
+
+                attributes_dfs = attributes_compare(fc_list)
+                if attributes_dfs is not None:
+                    fc_dfs.extend(attributes_dfs)
+            except Exception:
+                # any error is recorded and the comparison moves on, so one bad feature class does not lose the report
+                logger.warning('\tComparison failed for {}: \n\t{}'.format(fc, traceback.format_exc()))
+                failed = True
+            except BaseException:
+                # write out what was held back before the error propagates, so the log shows where the run stopped
+                for record in log_buffer.stop():
+                    log_handler.handle(record)
+                raise
+            return fc_dfs, failed, log_buffer.stop()
+
+        df_list = []
+        failed_fcs = []
+        log_handler.addFilter(log_buffer)
+        fcs = [fc for fc in sorted(common_dict['feature_classes']) if not any(o in fc for o in omit_list)]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(compare_fc, fcs) if max_workers > 1 else map(compare_fc, fcs)
+            for fc, (fc_dfs, failed, records) in zip(fcs, results):
+                for record in records:
+                    log_handler.handle(record)
+                df_list.extend(fc_dfs)
+                if failed:
+                    failed_fcs.append(fc)
+
+        # iterate through common tables and compare spatial reference, schema, and attributes
+        # (calling functions from compare_feature.py)
+        for table in (table for table in sorted(common_dict['tables']) if not any(o in table for o in omit_list)):
+            try:
+                logger.info('\nComparing table: {}'.format(table))
+                base_table = gdb_list[0]+'\\'+table
+                test_table = gdb_list[1]+'\\'+table
+                table_list = [base_table, test_table]
+
+                schema_df = schema_compare(table_list)
+                if schema_df is not None:
+                    df_list.append(schema_df)
+                    logger.info('\tSchemas do not match. See Excel report.')
+                elif schema_df is None:
+                    logger.info('\tSchemas match.')
+
+                attributes_dfs = attributes_compare(table_list)
+                if attributes_dfs is not None:
+                    df_list.extend(attributes_dfs)
+            except Exception:
+                logger.warning('\tComparison failed for {}: \n\t{}'.format(table, traceback.format_exc()))
+                failed_fcs.append(table)
+
+        if failed_fcs:
+            logger.warning('\nComparison failed for feature class(es)/table(s): {}. Add them to omit_list to '
+                           'skip them on a re-run.'.format(', '.join(failed_fcs)))
+        logger.info('\nGeodatabase comparison completed at: {}'.format(dt.now()))
+
+        # export list of dataframes to Excel
+        if df_list:
+            compile_report(gdb_name, df_list, out_dir)
+            logger.info('Export completed at: {}'.format(dt.now()))
+    finally:
+        # detach this comparison's log file even if it failed part way, so later comparisons do not write to it
+        log_handler.removeFilter(log_buffer)
+        logger.removeHandler(log_handler)
+        log_handler.close()
+
+    return failed_fcs
@@ -0,0 +1,36 @@
+# ================================================================================================================
+# Title: open_in_excel.py
+# Author: Conor MacNaughton (idir: cmacnaug)
+# Date created: 2022/03/25
+# Date updated:
+# Description: Converts the Arrow (.arrow) files written by compile_report(..., format='feather') for an environment
+#              back into a single Excel comparison report, one sheet per file (calling report_writer.py).
+# Python Version: 3.7
+# ================================================================================================================
+
+import os
+import glob
+import pandas as pd
+from report_writer import compile_report
+
+# enter the folder containing the .arrow files, the environment name they were written for, and an output location
+arrow_dir = r''
+env_name = r''
+output_loc = r''
+
+# read each <env_name>__<sheet name>.arrow file back into a dataframe named after its sheet
+# (the _summary file is skipped as compile_report creates a new one)
+df_list = []
+for arrow_file in sorted(glob.glob(os.path.join(arrow_dir, env_name + '__*.arrow'))):
+    sheet_name = os.path.splitext(os.path.basename(arrow_file))[0][len(env_name + '__'):]
+    if sheet_name == '_summary':
+        continue
+    df = pd.read_feather(arrow_file)
+    df.name = sheet_name
+    df_list.append(df)
+
+if df_list:
+    compile_report(env_name, df_list, output_loc)
+    print('\nExcel report exported to {}'.format(output_loc))
+else:
+    print('\nNo .arrow files found for {} in {}'.format(env_name, arrow_dir))
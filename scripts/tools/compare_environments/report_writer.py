@@ -0,0 +1,420 @@
+# ================================================================================================================
+# Title: report_writer.py
+# Author: Conor MacNaughton (idir: cmacnaug)
+# Date created: 2022/03/25
+# Date updated:
+# Description: Writes the dataframes produced by the compare_feature.py functions to an Excel (or Arrow) report.
+#              Kept free of arcpy so that the worker processes started by compile_report, and scripts that only
+#              convert results (eg. open_in_excel.py), do not need to import it.
+# Python Version: 3.7
+# ================================================================================================================
+
+import os
+import re
+import itertools
+import tempfile
+import zipfile
+import pandas as pd
+import numpy as np
+import xlsxwriter
+import openpyxl
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from xml.sax.saxutils import escape
+
+# Intel ISA-L's SIMD-accelerated zlib drop-in, used to compress Excel reports when installed
+try:
+    from isal import isal_zlib
+except ImportError:
+    isal_zlib = None
+
+# xlsxwriter Workbook options used for comparison reports. Strings are written as plain text; skipping xlsxwriter's
+# url/formula/number checks saves a regex per string cell.
+XLSX_OPTIONS = {'default_date_format': 'YYYY-MM-DD',
+                'strings_to_urls': False,
+                'strings_to_formulas': False,
+                'strings_to_numbers': False}
+
+# dataframes with more rows than this are written in xlsxwriter's constant_memory mode, so that memory stays flat
+LARGE_FRAME_ROWS = 100000
+
+# number of rows converted to Python lists at a time when writing a sheet row by row
+EXCEL_ROW_BLOCK = 10000
+
+# the most data rows an Excel sheet can hold (below its header row); longer dataframes are split across sheets
+XLSX_MAX_ROWS = 1048575
+
+# Office Open XML boilerplate for reports written by _direct_xlsx
+_MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '<Override PartName="/xl/sharedStrings.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+    '{}</Types>')
+_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="' + _REL_NS + '/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>')
+_WORKBOOK_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="' + _MAIN_NS + '" xmlns:r="' + _REL_NS + '"><sheets>{}</sheets></workbook>')
+_WORKBOOK_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{}'
+    '<Relationship Id="rId{styles_id}" Type="' + _REL_NS + '/styles" Target="styles.xml"/>'
+    '<Relationship Id="rId{strings_id}" Type="' + _REL_NS + '/sharedStrings" Target="sharedStrings.xml"/>'
+    '</Relationships>')
+_STYLES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="' + _MAIN_NS + '">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/><family val="2"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>')
+
+
+def split_dataframe(df, chunk_size=1000000):
+    """Split large dataframes into smaller chunks so that they can be exported to Excel.
+    \nParameters:
+    \tdf (dataframe): dataframe to be split
+    \nchunk_size (int): the number of records to split off into each chunk
+    \nReturns:
+    \tchunks (list): list of dataframes (chunks)"""
+    chunks = list()
+    num_chunks = df.shape[0] // chunk_size + 1
+    for i in range(num_chunks):
+        chunks.append(df[i*chunk_size:(i+1)*chunk_size])
+    for n, chunk in enumerate(chunks):
+        chunk.name = df.name + '_' + str(n + 1)
+    return chunks
+
+
+class _FastZipFile(zipfile.ZipFile):
+    """ZipFile that deflates at compression level 1 unless another level is given. Level 1 roughly halves the time
+    spent compressing an xlsx package compared to the default (6) for a file about 10% larger."""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('compresslevel', 1)
+        super().__init__(*args, **kwargs)
+
+    def writestr(self, zinfo_or_arcname, data, compress_type=None, compresslevel=None):
+        if compresslevel is None:
+            compresslevel = self.compresslevel
+        super().writestr(zinfo_or_arcname, data, compress_type, compresslevel)
+
+
+@contextmanager
+def _fast_zip():
+    """Context manager in which xlsxwriter packages workbooks with _FastZipFile instead of zipfile.ZipFile, and
+    zipfile compresses with isal_zlib (same deflate output, several times faster) when isal is installed."""
+    zip_file = xlsxwriter.workbook.ZipFile
+    zlib = zipfile.zlib
+    xlsxwriter.workbook.ZipFile = _FastZipFile
+    if isal_zlib is not None:
+        zipfile.zlib = isal_zlib
+    try:
+        yield
+    finally:
+        xlsxwriter.workbook.ZipFile = zip_file
+        zipfile.zlib = zlib
+
+
+def _excel_columns(df):
+    """Convert the index and columns of a dataframe to object arrays of values ready to be written to Excel, in a
+    single vectorized pass per column rather than cell by cell. Null-like (NaN, NaT, pd.NA) and infinite values
+    become None so they are written as blank cells, and date columns become YYYY-MM-DD strings.
+    \nParameters:
+    \tdf (dataframe): dataframe to be written
+    \nReturns:
+    \n\tcolumns (list): list of numpy arrays, index first"""
+    columns = []
+    for values in [pd.Series(df.index)] + [df.iloc[:, c] for c in range(df.shape[1])]:
+        if pd.api.types.is_datetime64_any_dtype(values):
+            values = values.dt.strftime('%Y-%m-%d')
+        mask = values.isna().to_numpy()
+        if pd.api.types.is_float_dtype(values):
+            mask = mask | np.isinf(values.to_numpy(dtype=float, na_value=np.nan))
+        columns.append(np.where(mask, None, values.to_numpy(dtype=object)))
+
+    return columns
+
+
+def _excel_rows(df):
+    """Yield the rows of a dataframe (index first) as lists ready to be written to Excel (see _excel_columns). Rows
+    are converted EXCEL_ROW_BLOCK at a time, so the streaming and constant_memory writers never hold a whole sheet.
+    \nParameters:
+    \tdf (dataframe): dataframe to be written
+    \nYields:
+    \n\trow (list): list of row values"""
+    for start in range(0, df.shape[0], EXCEL_ROW_BLOCK):
+        yield from np.column_stack(_excel_columns(df.iloc[start:start + EXCEL_ROW_BLOCK])).tolist()
+
+
+def _write_df_fast(book, df):
+    """Write a dataframe (index included) to a new sheet of an xlsxwriter workbook, feeding whole rows to the
+    worksheet rather than going through the per-cell formatting path of DataFrame.to_excel.
+    \nParameters:
+    \tbook (Workbook): xlsxwriter workbook (eg. ExcelWriter.book)
+    \tdf (dataframe): dataframe to write. The sheet is named after df.name"""
+    ws = book.add_worksheet(df.name)
+    headers = [df.index.name] + list(df.columns)
+    ws.write_row(0, 0, headers)
+
+    # freeze the header row and size each column to its header once per sheet, rather than formatting cells
+    ws.freeze_panes(1, 0)
+    for c, header in enumerate(headers):
+        ws.set_column(c, c, min(max(len('' if header is None else str(header)), 8) + 2, 50))
+
+    # numeric-only dataframes are written a column at a time, unless the workbook is in constant_memory mode
+    # (which requires rows to be written in order)
+    if not book.constant_memory and all(pd.api.types.is_numeric_dtype(dtype) for dtype in df.dtypes):
+        for c, values in enumerate(_excel_columns(df)):
+            ws.write_column(1, c, values.tolist())
+    else:
+        for r, row in enumerate(_excel_rows(df), start=1):
+            ws.write_row(r, 0, row)
+
+
+def _write_sheet_xlsx(job):
+    """Write one dataframe to its own single-sheet xlsx file. Worker for the parallel path of compile_report.
+    Constant memory mode is used so strings are stored inline and the sheet XML does not depend on a shared
+    strings table, which lets it be moved into another workbook as-is.
+    \nParameters:
+    \tjob (tuple): (path of xlsx file to write, sheet name, dataframe)"""
+    path, name, df = job
+    # custom attributes like df.name do not survive pickling
+    df.name = name
+    wb = xlsxwriter.Workbook(path, dict(XLSX_OPTIONS, constant_memory=True))
+    wb.use_zip64()
+    _write_df_fast(wb, df)
+    with _fast_zip():
+        wb.close()
+
+
+def _merge_sheet_xlsx(path, sheet_names, part_paths, tmp_dir):
+    """Assemble single-sheet xlsx files written by _write_sheet_xlsx into one workbook. An empty workbook holding
+    every sheet name provides the package parts (workbook.xml, rels, content types), then each of its empty sheets
+    is swapped for the sheet XML of the matching part file.
+    \nParameters:
+    \tpath (str): path of Excel file to save
+    \tsheet_names (list): sheet names, in the same order as part_paths
+    \tpart_paths (list): paths of single-sheet xlsx files
+    \ttmp_dir (str): directory for intermediate files"""
+    skeleton = os.path.join(tmp_dir, 'skeleton.xlsx')
+    wb = xlsxwriter.Workbook(skeleton, dict(XLSX_OPTIONS, constant_memory=True))
+    for name in sheet_names:
+        wb.add_worksheet(name)
+    wb.close()
+
+    parts = {}
+    styles = b''
+    for n, part_path in enumerate(part_paths, start=1):
+        with zipfile.ZipFile(part_path) as part:
+            sheet_xml = part.read('xl/worksheets/sheet1.xml')
+            part_styles = part.read('xl/styles.xml')
+        # only the first sheet should be selected when the workbook is opened
+        if n > 1:
+            sheet_xml = sheet_xml.replace(b' tabSelected="1"', b'', 1)
+        parts['xl/worksheets/sheet{}.xml'.format(n)] = sheet_xml
+        # the parts only differ in whether the date format was used, so keep the most complete styles
+        if len(part_styles) > len(styles):
+            styles = part_styles
+    parts['xl/styles.xml'] = styles
+
+    with zipfile.ZipFile(skeleton) as src, _FastZipFile(path, 'w', zipfile.ZIP_DEFLATED) as dst:
+        for item in src.infolist():
+            dst.writestr(item, parts.get(item.filename) or src.read(item.filename))
+
+
+def _arrow_frame(df):
+    """Prepare a dataframe for writing to Arrow. Object columns that may mix value types (eg. base_val and test_val
+    of attribute comparisons) are converted to strings, keeping nulls as None, and column names are made strings.
+    \nParameters:
+    \tdf (dataframe): dataframe to be written
+    \nReturns:
+    \n\tdf (dataframe): converted copy of dataframe"""
+    df = df.copy()
+    df.columns = df.columns.astype(str)
+    for col in df.columns[df.dtypes == object]:
+        df[col] = df[col].map(lambda v: None if pd.isna(v) else str(v))
+
+    return df
+
+
+def _xml_text(value):
+    """Escape a string for use as XML text or an attribute value. Characters that XML cannot hold are written as
+    Excel's _xHHHH_ escapes.
+    \nParameters:
+    \tvalue (str): string to escape
+    \nReturns:
+    \n\tvalue (str): escaped string"""
+    value = escape(value, {'"': '&quot;'})
+    return _XML_ILLEGAL.sub(lambda m: '_x{:04X}_'.format(ord(m.group())), value)
+
+
+def _col_letter(n):
+    """Convert a zero-based column index to an Excel column label. eg. 0 -> 'A', 27 -> 'AB'
+    \nParameters:
+    \tn (int): column index
+    \nReturns:
+    \n\tletters (str): column label"""
+    letters = ''
+    n += 1
+    while n:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _direct_xlsx(path, df_list):
+    """Write dataframes (index included) to separate sheets of an Excel workbook by generating the Office Open XML
+    parts directly, without pandas' or xlsxwriter's per-cell writing. Sheet XML is streamed into the zip package row by
+    row while a single shared strings table is built up, and the workbook boilerplate parts are written last.
+    No cell styling is applied.
+    \nParameters:
+    \tpath (str): path of Excel file to save
+    \tdf_list (list): list of dataframes to export. Sheets are named after df.name"""
+    strings = {}
+    string_count = 0
+
+    with _FastZipFile(path, 'w', zipfile.ZIP_DEFLATED) as xlsx:
+        for n, df in enumerate(df_list, start=1):
+            letters = [_col_letter(c) for c in range(df.shape[1] + 1)]
+            rows = itertools.chain([[df.index.name] + list(df.columns)], _excel_rows(df))
+            # the size of a streamed part is not known up front, so allow for one over 2 GB
+            with xlsx.open('xl/worksheets/sheet{}.xml'.format(n), 'w', force_zip64=True) as sheet:
+                sheet.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                            '<worksheet xmlns="{}"><sheetData>'.format(_MAIN_NS).encode('utf-8'))
+                for r, row in enumerate(rows, start=1):
+                    cells = ['<row r="{}">'.format(r)]
+                    for letter, value in zip(letters, row):
+                        if value is None:
+                            continue
+                        if isinstance(value, (bool, np.bool_)):
+                            cells.append('<c r="{}{}" t="b"><v>{:d}</v></c>'.format(letter, r, bool(value)))
+                        elif isinstance(value, (int, float, np.number)):
+                            if isinstance(value, np.number):
+                                value = value.item()
+                            cells.append('<c r="{}{}"><v>{!r}</v></c>'.format(letter, r, value))
+                        else:
+                            value = str(value)
+                            index = strings.setdefault(value, len(strings))
+                            string_count += 1
+                            cells.append('<c r="{}{}" t="s"><v>{}</v></c>'.format(letter, r, index))
+                    cells.append('</row>')
+                    sheet.write(''.join(cells).encode('utf-8'))
+                sheet.write(b'</sheetData></worksheet>')
+
+        # strings with leading or trailing whitespace need xml:space="preserve" to keep it
+        sst = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+               '<sst xmlns="{}" count="{}" uniqueCount="{}">'.format(_MAIN_NS, string_count, len(strings))]
+        for string in strings:
+            space = ' xml:space="preserve"' if string != string.strip() else ''
+            sst.append('<si><t{}>{}</t></si>'.format(space, _xml_text(string)))
+        sst.append('</sst>')
+        xlsx.writestr('xl/sharedStrings.xml', ''.join(sst))
+
+        sheet_ids = range(1, len(df_list) + 1)
+        xlsx.writestr('[Content_Types].xml', _CONTENT_TYPES_XML.format(''.join(
+            '<Override PartName="/xl/worksheets/sheet{}.xml" ContentType="application/vnd.openxmlformats-'
+            'officedocument.spreadsheetml.worksheet+xml"/>'.format(n) for n in sheet_ids)))
+        xlsx.writestr('_rels/.rels', _RELS_XML)
+        xlsx.writestr('xl/workbook.xml', _WORKBOOK_XML.format(''.join(
+            '<sheet name="{}" sheetId="{}" r:id="rId{}"/>'.format(_xml_text(df.name), n, n)
+            for n, df in zip(sheet_ids, df_list))))
+        xlsx.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS_XML.format(''.join(
+            '<Relationship Id="rId{}" Type="{}/worksheet" Target="worksheets/sheet{}.xml"/>'.format(n, _REL_NS, n)
+            for n in sheet_ids), styles_id=len(df_list) + 1, strings_id=len(df_list) + 2))
+        xlsx.writestr('xl/styles.xml', _STYLES_XML)
+
+
+def compile_report(env_name, df_list, out_dir, streaming=False, constant_memory=False, processes=None,
+                   format='xlsx', direct=False):
+    """Export dataframes to separate sheets in an Excel workbook.
+    \nParameters:
+    \tenv_name (str): Name of environment (geodatabase) being evaluated. eg. 'Operational_Data'
+    \tdf_list (list): list of dataframes to export
+    \tout_dir (str): path of location to save Excel file
+    \tstreaming (bool): write rows straight to disk with an openpyxl write-only workbook instead of holding every
+    \t\tsheet in memory. Suited to very large reports. No cell styling (eg. date format) is applied. Default False
+    \tconstant_memory (bool): use xlsxwriter's constant_memory mode, flushing each row to disk as it is written.
+    \t\tCuts peak memory on very large reports, but rows can only be written in order (no merged cells spanning rows)
+    \t\tand strings are stored inline rather than in a shared strings table. Default False
+    \tprocesses (int): number of worker processes used to write sheets in parallel, each to its own xlsx, before
+    \t\tmerging them into one workbook. Sheets are always written in constant_memory mode on this path. On Windows
+    \t\tthe calling script must be guarded by if __name__ == '__main__'. Default None (write sheets one at a time)
+    \tformat (str): 'xlsx' (default) for an Excel report, or 'feather' to instead write each dataframe to its own
+    \t\tLZ4-compressed Arrow IPC file named <env_name>__<sheet name>.arrow, which is far quicker to write and read back.
+    \t\tUse open_in_excel.py to convert these to an Excel report when needed. Requires pyarrow
+    \tdirect (bool): generate the workbook XML directly rather than through xlsxwriter. Considerably faster for the
+    \t\tnarrow, repetitive sheets of comparison reports. No cell styling is applied. Default False
+    \nDataframes without rows are not given a sheet of their own. Instead a '_summary' sheet, written first, lists
+    the row count of every dataframe in df_list. Dataframes with more rows than fit on one sheet are split across
+    several sheets, and a report containing any dataframe of more than LARGE_FRAME_ROWS rows is written in
+    constant_memory mode."""
+
+    summary = pd.DataFrame({'rows': [df.shape[0] for df in df_list]},
+                           index=pd.Index([df.name for df in df_list], name='sheet'))
+    summary.name = '_summary'
+    df_list = [summary] + [df for df in df_list if df.shape[0] > 0]
+
+    if format == 'feather':
+        from pyarrow import feather
+        for df in df_list:
+            feather.write_feather(_arrow_frame(df), os.path.join(out_dir, env_name + '__' + df.name + '.arrow'),
+                                  compression='lz4')
+        return
+
+    df_list = [chunk for df in df_list
+               for chunk in (split_dataframe(df, XLSX_MAX_ROWS) if df.shape[0] > XLSX_MAX_ROWS else [df])]
+    constant_memory = constant_memory or any(df.shape[0] > LARGE_FRAME_ROWS for df in df_list)
+
+    path = os.path.join(out_dir, env_name + '_comparison_rpt.xlsx')
+
+    if direct:
+        with _fast_zip():
+            _direct_xlsx(path, df_list)
+        return
+
+    if streaming:
+        wb = openpyxl.Workbook(write_only=True)
+        for df in df_list:
+            ws = wb.create_sheet(df.name)
+            ws.append([df.index.name] + list(df.columns))
+            for row in _excel_rows(df):
+                ws.append(row)
+        wb.save(path)
+        return
+
+    if processes and len(df_list) > 1:
+        with tempfile.TemporaryDirectory(dir=out_dir) as tmp_dir:
+            part_paths = [os.path.join(tmp_dir, 'sheet{}.xlsx'.format(n + 1)) for n in range(len(df_list))]
+            jobs = [(part_path, df.name, df) for part_path, df in zip(part_paths, df_list)]
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                list(executor.map(_write_sheet_xlsx, jobs))
+            with _fast_zip():
+                _merge_sheet_xlsx(path, [df.name for df in df_list], part_paths, tmp_dir)
+        return
+
+    # the workbook is packaged once, when the writer is closed on leaving the with block
+    with _fast_zip(), pd.ExcelWriter(path, engine='xlsxwriter',
+                                     engine_kwargs={'options': dict(XLSX_OPTIONS,
+                                                                    constant_memory=constant_memory)}) as writer:
+        for df in df_list:
+            _write_df_fast(writer.book, df)
+
+        writer.book.use_zip64()
@@ -36,6 +36,7 @@ import os
 import time
 import logging
 import openpyxl
+import pandas as pd
 import pdb
 
 from argparse import ArgumentParser
@@ -163,47 +164,34 @@ def append_scanned_maps(in_fc, logger):
 
     logger.info('Reading the input feature class')
 
-    unique_eco_dict = {}
-    row_count = 0
-    row_total = int(arcpy.GetCount_management(in_fc).getOutput(0))
-    with arcpy.da.SearchCursor(in_fc, cfl) as cursor:
-        for row in cursor:
-            row_count += 1
-            for i in range(1, 4):
-                if row[cfl.index("SDEC_{}".format(i))] > 0:
-                    key_list = []
-                    key_list.append(str(row[cfl.index("BGC_ZONE")]).replace('None','').replace(' ',''))
-                    key_list.append(str(row[cfl.index("BGC_SUBZON")]).replace('None','').replace(' ',''))
-                    key_list.append(str(row[cfl.index("BGC_VRT")]).replace('None','').replace('0',''))
-                    key_list.append(str(row[cfl.index("BGC_PHASE")]).replace('None','').replace(' ',''))
-                    key_list.append(str(row[cfl.index("SITE_S{}".format(i))]).replace('None','').replace(' ',''))
-                    key_list.append(str(row[cfl.index("SITEMC_S{}".format(i))]).replace('None','').replace(' ',''))
-                    key_str = str(key_list)
-                    try:
-                        unique_eco_dict[key_str] += 1
-                    except:
-                        unique_eco_dict[key_str] = 1
-
-            if row_count % 100000 == 0 or row_count == row_total:
-                logger.info('    Read {} of {} records ({} unique ecosystems found)'.format(row_count, row_total, 
-                    len(unique_eco_dict.keys())))
-
-    alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
-    columns = []
-    for letter in alphabet:
-        columns.append(letter)
-    for letter1 in alphabet:
-        for letter2 in alphabet:
-            columns.append(letter1 + letter2)
+    # Read the attribute table in one call, then count the unique ecosystems of all three site deciles with a single
+    # groupby rather than building a dictionary key for each decile of each row. Nulls are read as 0 in the numeric
+    # fields and as empty strings in the text fields, so no 'None' text needs to be stripped out afterwards.
+    null_value = {f: 0 for f in ['BGC_VRT', 'SDEC_1', 'SDEC_2', 'SDEC_3']}
+    null_value.update({f: '' for f in cfl if f not in null_value})
+    eco_df = pd.DataFrame(arcpy.da.FeatureClassToNumPyArray(in_fc, cfl, skip_nulls=False, null_value=null_value))
+    key_fields = ['BGC_ZONE', 'BGC_SUBZON', 'BGC_VRT', 'BGC_PHASE', 'SITE_S', 'SITEMC_S']
+    decile_dfs = []
+    for i in range(1, 4):
+        decile_df = eco_df.loc[eco_df["SDEC_{}".format(i)] > 0, ['BGC_ZONE', 'BGC_SUBZON', 'BGC_VRT', 'BGC_PHASE',
+                                                                "SITE_S{}".format(i), "SITEMC_S{}".format(i)]]
+        decile_df.columns = key_fields
+        decile_dfs.append(decile_df)
+    key_df = pd.concat(decile_dfs).astype(str)
+    for f in key_fields:
+        key_df[f] = key_df[f].str.replace('0' if f == 'BGC_VRT' else ' ', '', regex=False)
+    eco_freq = key_df.groupby(key_fields).size()
+    unique_eco_dict = {key: int(freq) for key, freq in eco_freq.items()}
+    logger.info('    Read {} records ({} unique ecosystems found)'.format(len(eco_df), len(unique_eco_dict.keys())))
 
     fgdb_parent_folder = os.path.split(os.path.split(in_fc)[0])[0]
     out_xlsx = os.path.join(fgdb_parent_folder, 
-                            'WHR_STS_Lookup_Table_Template_{}.csv'.format(time.strftime("%Y%m%d_%H%M%S")))
+                            'WHR_STS_Lookup_Table_Template_{}.xlsx'.format(time.strftime("%Y%m%d_%H%M%S")))
 
     logging.info("Writing output file {}".format(out_xlsx))
-    wb = openpyxl.Workbook()
-    wb.save(out_xlsx)
-    sheet = wb.get_sheet_by_name("Sheet")
+    # write-only workbook streams rows to disk as they are appended rather than holding every cell in memory
+    wb = openpyxl.Workbook(write_only=True)
+    sheet = wb.create_sheet("Sheet")
 
     header_list = ['FREQ', 'Bgc_zone', 'Bgc_subzon', 'Bgc_vrt', 'Bgc_phase', 'BEC_Label', 'ECOS_C', 'SITE_S', 
                    'SITEMC_S', 'Site Series Name', 'Plant Community Name', 'Habitat_Subtype', 'Ecosystem_Description', 
@@ -215,17 +203,12 @@ def append_scanned_maps(in_fc, logger):
                    'STS_Age_181-200', 'STS_Age_201-250', 'STS_Age_251-399', 'STS_Age_400+', 'SS2_Age_Max', 
                    'STS3a_Age_Max', 'STS3b_Age_Max', 'STS4_Age_Max', 'STS5_Age_Max', 'STS6_Age_Max', 'STS7_Age_Min', 
                    'STS7a_Max', 'STS7b_Min', 'STS7d_Min', 'Short_Term_Trend_Age', 'Long_Term_Trend_Age']
-    i = 0
-    for header in header_list:
-        sheet[columns[i] + "1"].value = header
-        i += 1
+    sheet.append(header_list)
 
     row = 1
-    for key_str in sorted(set(unique_eco_dict.keys())):
+    for key_tup in sorted(unique_eco_dict):
         row += 1
-        key_list = ast.literal_eval(key_str)
-        for i in range(0, len(key_list)):
-            sheet["{}{}".format(columns[i], row)].value = str(key_list[i])
+        sheet.append([str(key) for key in key_tup])
 
     logging.info("Wrote {} rows to output file {}".format(row, out_xlsx))
     wb.save(out_xlsx)
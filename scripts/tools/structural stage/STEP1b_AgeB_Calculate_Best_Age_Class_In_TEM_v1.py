@@ -124,24 +124,29 @@ def main(tem_fc, age_field_list_str):
 
     logging.info("Writing the best age class values to AGE_CL_STS and AGE_CL_STD")
 
+    # look up the cursor positions of each pair of fields once, rather than on every row
+    cfd = {}
+    for cursor_field in cfl:
+        cfd[cursor_field] = cfl.index(cursor_field)
+    age_idx_pairs = [(cfd[age_field], cfd[age_field.replace("STS", "STD")]) for age_field in age_field_list]
+    sts_idx = cfd["AGE_CL_STS"]
+    std_idx = cfd["AGE_CL_STD"]
+
     row_count = 0
     row_total = int(arcpy.GetCount_management(tem_fc).getOutput(0))
     with arcpy.da.UpdateCursor(tem_fc, cfl) as cursor:
         for row in cursor:
             row_count += 1
-            x = 0
             age_fields_written = False
-            while age_fields_written == False and x <= len(age_field_list) - 1:
-                if row[cfl.index(age_field_list[x])] not in [-1, None] and row[
-                        cfl.index(age_field_list[x].replace("STS", "STD"))] not in [-1, None]:
-                    row[cfl.index("AGE_CL_STS")] = row[cfl.index(age_field_list[x])]
-                    row[cfl.index("AGE_CL_STD")] = row[cfl.index(age_field_list[x].replace("STS", "STD"))]
+            for age_sts_idx, age_std_idx in age_idx_pairs:
+                if row[age_sts_idx] not in [-1, None] and row[age_std_idx] not in [-1, None]:
+                    row[sts_idx] = row[age_sts_idx]
+                    row[std_idx] = row[age_std_idx]
                     age_fields_written = True
-                else:
-                    x += 1
+                    break
             if not age_fields_written:
-                row[cfl.index("AGE_CL_STS")] = -1
-                row[cfl.index("AGE_CL_STD")] = -1
+                row[sts_idx] = -1
+                row[std_idx] = -1
             cursor.updateRow(row)
             if row_count % 100000 == 0 or row_count == row_total:
                 logging.info("    Processed " + str(row_count) + " of " + str(row_total) + " rows")
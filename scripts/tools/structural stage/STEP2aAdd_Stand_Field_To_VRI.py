@@ -123,6 +123,12 @@ def main(vri_fc):
     cfl = ["SPECIES_CD_1", "SPECIES_CD_2", "SPECIES_CD_3", "SPECIES_CD_4", "SPECIES_CD_5", "SPECIES_CD_6",
            "SPECIES_PCT_1", "SPECIES_PCT_2", "SPECIES_PCT_3", "SPECIES_PCT_4", "SPECIES_PCT_5", "SPECIES_PCT_6", 
            "STD_VRI"]
+    # look up the cursor positions of each species code/percent pair once, rather than on every row
+    cfd = {}
+    for cursor_field in cfl:
+        cfd[cursor_field] = cfl.index(cursor_field)
+    species_idx_pairs = [(cfd["SPECIES_CD_" + x], cfd["SPECIES_PCT_" + x]) for x in ["1", "2", "3", "4", "5", "6"]]
+    std_vri_idx = cfd["STD_VRI"]
     row_count = 0
     row_total = int(arcpy.GetCount_management(vri_fc).getOutput(0))
     with arcpy.da.UpdateCursor(vri_fc, cfl) as cursor:
@@ -130,21 +136,21 @@ def main(vri_fc):
             row_count += 1
             all_pct_null = True
             b_pct = 0
-            for x in ["1", "2", "3", "4", "5", "6"]:
-                if str(row[cfl.index("SPECIES_CD_" + x)]).upper() in b_species:
-                    if row[cfl.index("SPECIES_PCT_" + x)] > 0:
-                        b_pct += row[cfl.index("SPECIES_PCT_" + x)]
-                if row[cfl.index("SPECIES_PCT_" + x)] > 0:
+            for cd_idx, pct_idx in species_idx_pairs:
+                if str(row[cd_idx]).upper() in b_species:
+                    if row[pct_idx] > 0:
+                        b_pct += row[pct_idx]
+                if row[pct_idx] > 0:
                     all_pct_null = False
             
             if all_pct_null:
-                row[cfl.index("STD_VRI")] = ""
+                row[std_vri_idx] = ""
             elif b_pct < 25:
-                row[cfl.index("STD_VRI")] = "C"
+                row[std_vri_idx] = "C"
             elif b_pct < 75:
-                row[cfl.index("STD_VRI")] = "M"
+                row[std_vri_idx] = "M"
             else:
-                row[cfl.index("STD_VRI")] = "B"
+                row[std_vri_idx] = "B"
             
             cursor.updateRow(row)
 
@@ -37,7 +37,9 @@ import os
 import sys
 import ctypes
 import pdb
-import operator
+
+import numpy as np
+import pandas as pd
 
 from argparse import ArgumentParser
 from argparse import RawTextHelpFormatter
@@ -90,17 +92,15 @@ def main(tem_fc, vri_fc):
         logging.error("**** Specified TEM feature class {} does not exist. Exiting script.".format(tem_fc))
         sys.exit()
 
-    teis_id_field_found = False
-    for f in arcpy.ListFields(tem_fc):
-        if f.name == "TEIS_ID":
-            teis_id_field_found = True
-            if f.type not in ["Integer", "SmallInteger"]:
-                logging.error("**** TEIS_ID field in specified TEM feature class is not a numeric field. "
-                              "Exiting script.")
-                sys.exit()
-    if not teis_id_field_found:
+    # the TEM field list is read once here and reused below
+    tem_fields = {f.name: f for f in arcpy.ListFields(tem_fc)}
+    if "TEIS_ID" not in tem_fields:
         logging.error("**** Specified TEM feature class does not have a TEIS_ID field. Exiting script.")
         sys.exit()
+    if tem_fields["TEIS_ID"].type not in ["Integer", "SmallInteger"]:
+        logging.error("**** TEIS_ID field in specified TEM feature class is not a numeric field. "
+                      "Exiting script.")
+        sys.exit()
 
     if not arcpy.Exists(vri_fc):
         logging.error("**** Specified VRI feature class does not exist. Exiting script.")
@@ -117,30 +117,33 @@ def main(tem_fc, vri_fc):
     # ---------------------------------------------------------------------------------------------------------
 
     logging.info("Checking that TEM TEIS_ID field contains unique values")
-    teis_id_count_dict = {}
-    row_count = 0
-    total_count = int(arcpy.GetCount_management(tem_fc).getOutput(0))
-    dupe_teis_id_found = False
-    for row in arcpy.da.SearchCursor(tem_fc, ["TEIS_ID"]):
-        row_count += 1
-        try:
-            teis_id_count_dict[row[0]] += 1
-        except:
-            teis_id_count_dict[row[0]] = 1
-        if teis_id_count_dict[row[0]] > 1:
-            dupe_teis_id_found = True
-        if row_count % 100000 == 0 or row_count == total_count:
-            logging.info("    - Read " + str(row_count) + " of " + str(total_count) + " rows")
-    if dupe_teis_id_found:
+    # This is the only full read of the TEM table; the TEIS_ID values are kept for the STD_VRI join below. Every
+    # row is needed for that join, so the row count comes from this read rather than a separate GetCount, and the
+    # uniqueness check gains nothing from stopping at the first duplicate.
+    # Null TEIS_IDs are read as -1 so that more than one of them counts as a duplicate.
+    tem_arr = arcpy.da.TableToNumPyArray(tem_fc, ["TEIS_ID", "OID@"], skip_nulls=False, null_value={"TEIS_ID": -1})
+    tem_row_total = len(tem_arr)
+    teis_ids = tem_arr["TEIS_ID"]
+    dupe_teis_id_count = tem_row_total - len(np.unique(teis_ids))
+    logging.info("    - Read " + str(tem_row_total) + " rows")
+    if dupe_teis_id_count > 0:
+        logging.info("    - Found {} duplicate TEIS_ID value(s)".format(dupe_teis_id_count))
         logging.info("    - Duplicate TEIS_ID values found. Repopulating TEIS_ID field with OBJECTID values.")
+        max_teis_id = np.iinfo(np.int16 if tem_fields["TEIS_ID"].type == "SmallInteger" else np.int32).max
+        if tem_arr["OID@"].max() > max_teis_id:
+            logging.error("**** OBJECTID values exceed the largest value the {} TEIS_ID field can hold ({}). "
+                          "Exiting script.".format(tem_fields["TEIS_ID"].type, max_teis_id))
+            sys.exit()
         row_count = 0
         with arcpy.da.UpdateCursor(tem_fc, ["TEIS_ID", "OID@"]) as cursor:
             for row in cursor:
                 row_count += 1
                 row[0] = row[1]
                 cursor.updateRow(row)
-                if row_count % 100000 == 0 or row_count == total_count:
-                    logging.info("    - Updated " + str(row_count) + " of " + str(total_count) + " rows")
+                if row_count % 100000 == 0 or row_count == tem_row_total:
+                    logging.info("    - Updated " + str(row_count) + " of " + str(tem_row_total) + " rows")
+        # the join array keeps the OID dtype; the values were checked above to fit the TEIS_ID field
+        teis_ids = tem_arr["OID@"]
     else:
         logging.info("    - TEIS_ID field contains all unique values.")
 
@@ -148,11 +151,23 @@ def main(tem_fc, vri_fc):
     # Calculate STD_VRI values for each TEM polygon.
     # ---------------------------------------------------------------------------------------------------------
 
+    # Only TEM polygons that touch a VRI polygon can get a STD_VRI value, so select those first and run the overlay
+    # on the selection rather than the whole TEM. The spatial index lets the selection skip disjoint polygons cheaply.
+    logging.info("Selecting TEM polygons that intersect the VRI feature class")
+    tem_lyr = "tem_lyr"
+    arcpy.MakeFeatureLayer_management(tem_fc, tem_lyr)
+    arcpy.SelectLayerByLocation_management(tem_lyr, "INTERSECT", vri_fc)
+    selected_total = int(arcpy.GetCount_management(tem_lyr).getOutput(0))
+    logging.info("    - {} of {} TEM polygons selected".format(selected_total, tem_row_total))
+    if selected_total == 0:
+        logging.error("VRI and PEM/TEM feature classes do not overlap. Exiting.")
+        sys.exit()
+
     tab_int_tbl = tem_fc + "_tab_int_vri"
     logging.info("Creating Tabulate Intersection table " + tab_int_tbl)
     if arcpy.Exists(tab_int_tbl):
         arcpy.Delete_management(tab_int_tbl)
-    arcpy.TabulateIntersection_analysis(in_zone_features = tem_fc, zone_fields = "TEIS_ID", in_class_features = vri_fc, 
+    arcpy.TabulateIntersection_analysis(in_zone_features = tem_lyr, zone_fields = "TEIS_ID", in_class_features = vri_fc, 
                                         out_table = tab_int_tbl, class_fields = "STD_VRI", sum_fields = "", 
                                         xy_tolerance = "-1 Unknown", out_units = "UNKNOWN")
 
@@ -162,23 +177,14 @@ def main(tem_fc, vri_fc):
     # We are just going to store the area-dominant age class for STS, and later derive the age class STD from that.
     # Otherwise if we calculate them separately, they may not be "compatible", e.g. age class STS might be 10-20 but
     # age class STD might be 30-50 if they are calculated independently.
-    std_vri_dict = {}
+    # The overlay output is read in one call, then areas are summed per (TEIS_ID, STD_VRI) pair and reduced to the
+    # largest STD_VRI per TEIS_ID with a pandas groupby.
 
     if row_total > 0: ## sometimes the TabulateIntersection tool results in an empty output table for no reason
-        logging.info("Reading Tabulate Intersection table to dictionary")
-        row_count = 0
-        for row in arcpy.da.SearchCursor(tab_int_tbl,["TEIS_ID", "STD_VRI", "AREA"]):
-            row_count += 1
-            try:
-                std_vri_dict[row[0]][row[1]] += row[2]
-            except:
-                try:
-                    std_vri_dict[row[0]][row[1]] = row[2]
-                except:
-                    std_vri_dict[row[0]] = {}
-                    std_vri_dict[row[0]][row[1]] = row[2]
-            if row_count % 100000 == 0 or row_count == row_total:
-                logging.info("    Read {} of {} rows".format(row_count, row_total))
+        logging.info("Reading Tabulate Intersection table")
+        area_df = pd.DataFrame(arcpy.da.TableToNumPyArray(tab_int_tbl, ["TEIS_ID", "STD_VRI", "AREA"],
+                                                          skip_nulls=False, null_value={"TEIS_ID": -1, "STD_VRI": ""}))
+        logging.info("    Read {} rows".format(row_total))
         tabulate_intersection_succeeded = True
 
     else: ## if output table was empty, run an Intersect instead
@@ -187,61 +193,60 @@ def main(tem_fc, vri_fc):
         intersect_fc = tem_fc + "_int_vri"
         if arcpy.Exists(intersect_fc):
             arcpy.Delete_management(intersect_fc)
-        arcpy.Intersect_analysis(in_features = vri_fc + " #;" + tem_fc + " #", out_feature_class = intersect_fc, 
+        arcpy.Intersect_analysis(in_features = vri_fc + " #;" + tem_lyr + " #", out_feature_class = intersect_fc, 
                                  join_attributes = "ALL", cluster_tolerance = "-1 Unknown", output_type = "INPUT")
         row_total = int(arcpy.GetCount_management(intersect_fc).getOutput(0))
         if row_total > 0:
-            logging.info("Reading Intersect output feature class table to dictionary")
-            row_count = 0
-            for row in arcpy.da.SearchCursor(intersect_fc, ["TEIS_ID", "STD_VRI", "SHAPE@AREA"]):
-                row_count += 1
-                try:
-                    std_vri_dict[row[0]][row[1]] += row[2]
-                except:
-                    try:
-                        std_vri_dict[row[0]][row[1]] = row[2]
-                    except:
-                        std_vri_dict[row[0]] = {}
-                        std_vri_dict[row[0]][row[1]] = row[2]
-                if row_count % 100000 == 0 or row_count == row_total:
-                    logging.info("    Read " + str(row_count) + " of " + str(row_total) + " rows")
+            logging.info("Reading Intersect output feature class table")
+            area_df = pd.DataFrame(arcpy.da.FeatureClassToNumPyArray(intersect_fc,
+                                                                     ["TEIS_ID", "STD_VRI", "SHAPE@AREA"],
+                                                                     skip_nulls=False,
+                                                                     null_value={"TEIS_ID": -1, "STD_VRI": ""}))
+            area_df.columns = ["TEIS_ID", "STD_VRI", "AREA"]
+            logging.info("    Read " + str(row_total) + " rows")
         else:
             arcpy.Delete_management(intersect_fc)
             logging.error("Intersection is empty; VRI and PEM/TEM feature classes do not overlap. Exiting.")
             sys.exit()
-
-    tem_fields = [f.name for f in arcpy.ListFields(tem_fc)]
-    if "STD_VRI" not in tem_fields:
+    # release the layer so the TEM schema can be changed below
+    arcpy.Delete_management(tem_lyr)
+
+    # overlay rows from TEM polygons with a null TEIS_ID (read as -1) cannot be joined back to the TEM, so drop them
+    area_df = area_df[area_df["TEIS_ID"] != -1]
+    std_vri_area = area_df.groupby(["TEIS_ID", "STD_VRI"])["AREA"].sum()
+    best = dict(std_vri_area.groupby(level=0).idxmax().values)
+    area_df = None
+
+    # build the STD_VRI value for every TEM polygon in memory and join it to the TEM in a single call,
+    # rather than writing each row through an UpdateCursor. ExtendTable can only add new fields, so an existing
+    # STD_VRI field is filled from a temporary field instead, keeping its position, alias, domain and length.
+    logging.info("Writing STD_VRI values to TEM")
+    if "STD_VRI" in tem_fields:
+        logging.info("Existing values will be overwritten in STD_VRI field in TEM.")
+        std_vri_field = "STD_VRI_TMP"
+        while std_vri_field in tem_fields:
+            std_vri_field += "_"
+        std_vri_len = tem_fields["STD_VRI"].length
+    else:
         logging.info("Adding new field STD_VRI to TEM feature class.")
-        arcpy.AddField_management(tem_fc, "STD_VRI", "TEXT", "#", "#", "1")
+        std_vri_field = "STD_VRI"
+        std_vri_len = 1
+    std_vri_arr = np.fromiter(((teis_id, best.get(teis_id, "")) for teis_id in teis_ids),
+                              dtype=[("TEIS_ID", teis_ids.dtype), (std_vri_field, "U{}".format(std_vri_len))],
+                              count=len(teis_ids))
+    arcpy.da.ExtendTable(tem_fc, "TEIS_ID", std_vri_arr, "TEIS_ID")
+    if std_vri_field != "STD_VRI":
+        arcpy.CalculateField_management(tem_fc, "STD_VRI", "!{}!".format(std_vri_field), "PYTHON3")
+        arcpy.DeleteField_management(tem_fc, std_vri_field)
+    # if a polygon had no entry in the dictionary, then there is no age class info for the polygon,
+    # so it was assigned an empty value.
+    no_std_vri_count = int(np.count_nonzero(std_vri_arr[std_vri_field] == ""))
+    if no_std_vri_count == 0:
+        logging.info("All {} TEM polygon(s) overlapped with an age polygon. That's good!".format(len(teis_ids)))
     else:
-        logging.info("Existing values will be overwritten in STD_VRI field in TEM.")
-
-    row_count = 0
-    no_std_vri_count = 0
-    row_total = int(arcpy.GetCount_management(tem_fc).getOutput(0))
-    logging.info("Writing STD_VRI values to TEM")
-    with arcpy.da.UpdateCursor(tem_fc,["TEIS_ID", "STD_VRI"]) as cursor:
-        for row in cursor:
-            row_count += 1
-            try:
-                biggest_std_vri = max(std_vri_dict[row[0]].iteritems(), key=operator.itemgetter(1))[0]    
-                ## see http://stackoverflow.com/questions/268272/getting-key-with-maximum-value-in-dictionary
-                row[1] = biggest_std_vri
-            except:
-                # if the current polygon had no entry in the dictionary, then there is no
-                # age class info for the polygon, so assign it values of -1.
-                row[1] = ""
-                no_std_vri_count += 1
-            cursor.updateRow(row)
-            if row_count % 100000 == 0 or row_count == row_total:
-                logging.info("    Processed {} of {} rows".format(row_count, row_total))
-        if no_std_vri_count == 0:
-            logging.info("All {} TEM polygon(s) overlapped with an age polygon. That's good!".format(row_total))
-        else:
-            logging.info("**** WARNING: There were {} polygon(s) for which age classes could "
-                         "not be calculated. These polygons probably don't overlap with any polygons in the age "
-                         "feature class.".format(no_std_vri_count))
+        logging.info("**** WARNING: There were {} polygon(s) for which age classes could "
+                     "not be calculated. These polygons probably don't overlap with any polygons in the age "
+                     "feature class.".format(no_std_vri_count))
     # arcpy.Delete_management(tab_int_tbl)
 
     # ---------------------------------------------------------------------------------------------------------
@@ -1,4 +1,5 @@
 import arcpy
+import numpy as np
 
 infc = 'BC_Grids_All_20k_to_BC'
 
@@ -9,19 +10,14 @@ inputfc= arcpy.GetParameterAsText(0)
 # If map sheet count >1 use dissolve sso its pretty for Deepa, if 1 sheet copy geometry
 
 
-# Pass a feature layer created in mememory into the search cursor, it will grab geometry from those records, put into an array
-# Features passed into array are a series of points
-array = arcpy.Array()
+# Read every vertex of the features in one call, as an array of x,y pairs
+# Adjacent map sheets share their corner vertices, so drop the duplicates before building points
+pts = arcpy.da.FeatureClassToNumPyArray(infc, ["SHAPE@XY"], explode_to_points=True)["SHAPE@XY"]
+pts = np.unique(pts, axis=0)
 
-for row in arcpy.da.SearchCursor(infc, ["SHAPE@"]):
-    row[0].generalize(.1)
-    for point in row[0]:
-        for pts in point:
-            array.add(pts)
-
-# Convert array into polygon
-poly = arcpy.Polygon(array)
+# Convert points into a multipoint and take its convex hull
+hull = arcpy.Multipoint(arcpy.Array([arcpy.Point(x, y) for x, y in pts])).convexHull()
 
 # Insert polygon into destination feature along wtih all the other attributes from excel file
 cursor = arcpy.da.InsertCursor('test', ['SHAPE@'])
-cursor.insertRow([poly.convexHull()])
+cursor.insertRow([hull])
@@ -6,8 +6,14 @@ import sys
 import os
 import time
 import logging
-import openpyxl
-
+import itertools
+import multiprocessing
+import concurrent.futures
+import numpy as np
+import pandas as pd
+
+from collections import Counter
+from openpyxl.utils import get_column_letter
 from argparse import ArgumentParser
 from argparse import RawTextHelpFormatter
 from datetime import datetime as dt
@@ -23,10 +29,7 @@ class ArcPyLogHandler(logging.StreamHandler):
         """
         Write the log message
         """
-        try:
-            msg = record.msg.format(record.args)
-        except:
-            msg = record.msg
+        msg = record.getMessage()
 
         if record.levelno == logging.ERROR:
             arcpy.AddError(msg)
@@ -106,6 +109,85 @@ def get_input_parameter():
         exit(1)
 
 
+def validate_integer(values, length, min_value=-2147483648, max_value=2147483647):
+    """
+    Return (values, invalid) for a column of cells bound for a long integer field; blank cells become None and
+    anything other than a number within the field's range is flagged as invalid
+    """
+    blank = values.isna() | (values == '')
+    numbers = pd.to_numeric(values.where(values.map(type).isin([int, float, bool])), errors='coerce')
+    in_range = numbers.between(min_value, max_value)
+    # numbers are truncated towards zero, as int() would
+    whole_numbers = np.trunc(numbers.where(in_range)).astype('Int64').astype(object)
+    return whole_numbers.where(in_range, None), ~(blank | in_range)
+
+
+def validate_small_integer(values, length):
+    """
+    Return (values, invalid) for a column of cells bound for a short integer field; blank cells become None
+    """
+    return validate_integer(values, length, -32768, 32767)
+
+
+def validate_string(values, length):
+    """
+    Return (values, invalid) for a column of cells bound for a text field of the given length; blank cells become ''
+    """
+    blank = values.isna() | (values == '')
+    text = values.map(str).astype(object)
+    fits = text.str.len() <= length
+    return text.where(fits, None).where(~blank, ''), ~(blank | fits)
+
+
+def validate_unchecked(values, length):
+    """
+    Return (values, invalid) for a column of cells bound for a field type that is not validated
+    """
+    return values, pd.Series(False, index=values.index)
+
+
+FIELD_VALIDATORS = {'SmallInteger': validate_small_integer,
+                    'Integer': validate_integer,
+                    'String': validate_string}
+
+
+MAPSH_STRIP_TABLE = str.maketrans('', '', ' \t')
+
+
+def parse_mapsh(value):
+    """
+    Split a MAPSH_LST cell into its list of mapsheet labels, ignoring whitespace and empty entries
+    """
+    if value is None:
+        return []
+    return [mapsh for mapsh in str(value).translate(MAPSH_STRIP_TABLE).split(',') if mapsh]
+
+
+def union_geometries(geoms):
+    """
+    Union a list of arcpy geometries as a balanced tree (cascaded union) rather than folding each one into a
+    growing result, so no single union has to work against the accumulated outline of every previous part
+    """
+    while len(geoms) > 1:
+        paired = [geoms[i].union(geoms[i + 1]) for i in range(0, len(geoms) - 1, 2)]
+        if len(geoms) % 2 == 1:
+            paired.append(geoms[-1])
+        geoms = paired
+    return geoms[0]
+
+
+PARALLEL_UNION_MIN_KEYS = 2000
+
+
+def union_wkb(wkb_parts, spatial_reference_string):
+    """
+    Union mapsheet geometries given as WKB in a worker process, returning the result as WKB
+    """
+    spatial_reference = arcpy.SpatialReference()
+    spatial_reference.loadFromString(spatial_reference_string)
+    return union_geometries([arcpy.FromWKB(wkb, spatial_reference) for wkb in wkb_parts]).WKB
+
+
 def append_scanned_maps(input_xls, smm_fc, mg_fc, logger):
     if not os.path.isfile(input_xls):
         logger.error('Specified input Excel file does not exist. Exiting script.')
@@ -115,8 +197,10 @@ def append_scanned_maps(input_xls, smm_fc, mg_fc, logger):
         logger.error('Specified Scanned Maps Master feature class does not exist. Exiting script.')
         sys.exit(100)
 
-    smm_fc_f = [f.name for f in arcpy.ListFields(smm_fc) if not f.required]
-    if 'FILE_NAME' not in smm_fc_f:
+    # the field list of each feature class is read once and reused below
+    smm_fields = [f for f in arcpy.ListFields(smm_fc) if not f.required]
+    smm_field_dict = {f.name: {'TYPE': f.type, 'LENGTH': f.length} for f in smm_fields}
+    if 'FILE_NAME' not in smm_field_dict:
         logger.error('Specified Scanned Maps Master feature class does not contain required field FILE_NAME. Exiting '
                      'script.')
         sys.exit(100)
@@ -125,55 +209,50 @@ def append_scanned_maps(input_xls, smm_fc, mg_fc, logger):
         logger.error('Specified Mapsheet Grid feature class does not exist. Exiting script.')
         sys.exit(100)
 
-    mg_fc_f = [f.name for f in arcpy.ListFields(mg_fc) if not f.required]
+    mg_desc = arcpy.Describe(mg_fc)
+    mg_fc_f = [f.name for f in mg_desc.fields if not f.required]
     if 'MAP_TILE' not in mg_fc_f:
         logger.error('Specified Mapsheet Grid feature class does not contain required field MAP_TILE. Exiting script.')
         sys.exit(100)
 
     try:
         logger.info('Loading Excel file')
-        wb = openpyxl.load_workbook(input_xls)
+        xls = pd.ExcelFile(input_xls, engine='openpyxl')
     except:
         logger.error('Specified input file is not a valid Excel file. Exiting script.')
         sys.exit(100)
 
     sheet_name = 'Data_Entry_Template'
-    try:
-        sheet = wb.get_sheet_by_name(sheet_name)
-    except:
+    if sheet_name not in xls.sheet_names:
         logger.error('Input Excel file does not contain required worksheet {}. Exiting script.'.format(sheet_name))
         sys.exit(100)
-
-    alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
-    columns = []
-    for letter in alphabet:
-        columns.append(letter)
-    for letter1 in alphabet:
-        for letter2 in alphabet:
-            columns.append(letter1 + letter2)
-
+    # Read the whole sheet in one call. Values are kept as stored in Excel (no type conversion) so they can be
+    # validated against the Scanned Maps Master fields below; the index is set to the Excel row numbers. Only empty
+    # cells are read as missing, so that text such as "NA" or "null" is not taken for a blank cell.
+    with xls:
+        sheet_df = xls.parse(sheet_name, header=None, dtype=object, keep_default_na=False, na_values=[''])
+    sheet_df = sheet_df.where(sheet_df.notna(), None)
+    sheet_df.index += 1
+
+    # map each header to its (zero-based) column index
     xls_head_col_dict = {}
-    for column in columns:
-        header = sheet["{}1".format(column)].value
+    xls_col_count = 0
+    for header in (sheet_df.iloc[0].tolist() if len(sheet_df.index) > 0 else []):
         if header in ["", None]:
             break
         else:
-            xls_head_col_dict[header] = column
+            xls_head_col_dict[header] = xls_col_count
+            xls_col_count += 1
 
     if 'MAPSH_LST' not in xls_head_col_dict.keys():
         logger.error('Input Excel file does not contain required field MAPSH_LST. Exiting script.')
         sys.exit(100)
 
-    smm_field_dict = {}
-    for smm_field in arcpy.ListFields(smm_fc):
-        if not smm_field.required:
-            smm_field_dict[smm_field.name] = {'TYPE': smm_field.type, 'LENGTH': smm_field.length}
-
     # Determine the fields that the Excel file and smm_fc have in common. Alert the user about
-    # mismatched/missing field names.
-    common_fields = list(set.intersection(set(xls_head_col_dict.keys()), set(smm_field_dict.keys())))
-    xls_fields_unmatched = list(set(xls_head_col_dict.keys()).difference(set(smm_field_dict.keys())))
-    smm_fields_unmatched = list(set(smm_field_dict.keys()).difference(set(xls_head_col_dict.keys())))
+    # mismatched/missing field names. The lists are sorted so the field order is the same on every run.
+    common_fields = sorted(xls_head_col_dict.keys() & smm_field_dict.keys())
+    xls_fields_unmatched = sorted(xls_head_col_dict.keys() - smm_field_dict.keys())
+    smm_fields_unmatched = sorted(smm_field_dict.keys() - xls_head_col_dict.keys())
 
     if len(xls_fields_unmatched) > 0:
         logger.warning('Fields found in Excel file that are not in Scanned Maps Master:')
@@ -184,47 +263,57 @@ def append_scanned_maps(input_xls, smm_fc, mg_fc, logger):
         for field in smm_fields_unmatched:
             logger.warning('  - {}'.format(field))
 
-    # Read the MAPSH_LST column of the Excel table and compile a list of all mapsheets we will need to find
-    # the geometry for.
-    mapsh_geom_dict = {}
-    mapsh_list = []
-    xls_row = 1
-    xls_row_empty = False
+    # Keep the rows of the Excel table up to the first one with an empty first cell, and compile a list of all
+    # mapsheets in the MAPSH_LST column that we will need to find the geometry for.
+    logger.info('Reading Excel table')
+    data_df = sheet_df.iloc[1:, :xls_col_count]
+    empty_rows = data_df[0].isna() | (data_df[0] == '')
+    if empty_rows.any():
+        logger.debug('Row %s of Excel table is empty.', empty_rows.idxmax())
+        data_df = data_df.loc[:empty_rows.idxmax() - 1]
     mapsh_col = xls_head_col_dict['MAPSH_LST']
-    logger.info('Reading mapsheet labels from MAPSH_LST column of Excel file')
-    while not xls_row_empty:
-        xls_row += 1
-        if sheet["A{}".format(xls_row)].value in ['', None]:
-            xls_row_empty = True
-            logger.debug('Row {} of Excel table is empty.'.format(xls_row))
-        else:
-            mapsh_value = str(sheet['{}{}'.format(mapsh_col, xls_row)].value).replace('None', '').replace(' ', '')
-            for mapsh in mapsh_value.split(','):
-                mapsh_geom_dict[mapsh] = []
-                mapsh_list.append(mapsh)
+    mapsh_col_letter = get_column_letter(mapsh_col + 1)
+    mapsh_tiles = [parse_mapsh(value) for value in data_df[mapsh_col]]
+    blank_mapsh_cells = ["{}{}".format(mapsh_col_letter, xls_row)
+                         for xls_row, tiles in zip(data_df.index, mapsh_tiles) if not tiles]
+    if len(blank_mapsh_cells) > 0:
+        logger.error('No mapsheets listed in the following Excel sheet cells: {}'.format(', '.join(blank_mapsh_cells)))
+        sys.exit(100)
+    mapsh_keys = [tuple(sorted(tiles)) for tiles in mapsh_tiles]
+    mapsh_list = [mapsh for tiles in mapsh_tiles for mapsh in tiles]
+    mapsh_geom_dict = {mapsh: [] for mapsh in mapsh_list}
     logger.debug('Found {} unique mapsheets listed in column {} of Excel table'.format(len(mapsh_geom_dict.keys()),
-            mapsh_col))
+            mapsh_col_letter))
 
     # Read the geometries of each mapsheet found above from the mapsheet grid feature class
     cfl = ['MAP_TILE', 'SHAPE@']
     row_count = 0
-    row_total = int(arcpy.GetCount_management(mg_fc).getOutput(0))
-    found_count = 0
     logger.info('Reading {} geometries from {}'.format(len(mapsh_geom_dict.keys()), mg_fc))
-    for row in arcpy.da.SearchCursor(mg_fc, cfl):
-        row_count += 1
-        try:
-            mapsh_geom_dict[row[0]].append(row[1])
-        except:
-            pass
-        if row_count % 100000 == 0 or row_count == row_total:
-            found_count = len([mapsh for mapsh in mapsh_geom_dict.keys() if len(mapsh_geom_dict[mapsh]) > 0])
-            logger.debug('    Read {} of {} rows, found {} of {} mapsheets'.format(row_count, row_total, found_count, 
-                len(mapsh_geom_dict.keys())))
-    invalid_mapsheets = []
-    for mapsh in mapsh_geom_dict.keys():
-        if mapsh_geom_dict[mapsh] == []:
-            invalid_mapsheets.append(mapsh)
+    # An attribute index on MAP_TILE lets the database look up the listed mapsheets directly. The grid is a shared
+    # reference dataset, so the index is only suggested here rather than added by this script.
+    if 'MAP_TILE' not in [f.name for index in mg_desc.indexes for f in index.fields]:
+        logger.info('MAP_TILE field of {} has no attribute index; adding one (with Add Attribute Index) would speed '
+                    'up reading mapsheet geometries'.format(mg_fc))
+    # Only read the mapsheets listed in the Excel file, in batches of up to 1000 labels per IN list (the Oracle limit)
+    map_tile_field = arcpy.AddFieldDelimiters(mg_fc, 'MAP_TILE')
+    mapsh_labels = sorted(mapsh_geom_dict.keys())
+    wanted_mapsheets = set(mapsh_labels)
+    found_mapsheets = set()
+    for i in range(0, len(mapsh_labels), 1000):
+        where_clause = '{} IN ({})'.format(map_tile_field, ', '.join(
+            "'{}'".format(mapsh.replace("'", "''")) for mapsh in mapsh_labels[i:i + 1000]))
+        with arcpy.da.SearchCursor(mg_fc, cfl, where_clause=where_clause) as cursor:
+            for row in cursor:
+                row_count += 1
+                # databases with case-insensitive text comparison can return labels that differ in case, and only
+                # the first geometry of each mapsheet is used, so any duplicate tiles in the grid are not kept
+                mapsh = row[0]
+                if mapsh in wanted_mapsheets and mapsh not in found_mapsheets:
+                    mapsh_geom_dict[mapsh].append(row[1])
+                    found_mapsheets.add(mapsh)
+        logger.debug('    Read {} rows, found {} of {} mapsheets'.format(row_count, len(found_mapsheets),
+            len(wanted_mapsheets)))
+    invalid_mapsheets = sorted(wanted_mapsheets - found_mapsheets)
     if len(invalid_mapsheets) > 0:
         logger.error('Some mapsheets listed in MAPSH_LST column of Excel file are not found in BC Grid feature class:')
         # for invalid_mapsheet in invalid_mapsheets:
@@ -241,78 +330,23 @@ def append_scanned_maps(input_xls, smm_fc, mg_fc, logger):
     for common_field in common_fields:
         cfl.append(common_field)
     cfl.append("SHAPE@")
-    
-    # Loop through the Excel table and create a new feature (a list of attributes) for each row
-    xls_row = 1
-    xls_row_empty = False
-    new_smm_rows = []
-    invalid_values = []
-    logger.info('Reading Excel table')
-    while not xls_row_empty:
-        xls_row += 1
-        logger.debug('Reading row {} of Excel table'.format(xls_row))
-        if sheet["A{}".format(xls_row)].value in ['', None]:
-            xls_row_empty = True
-            logger.debug('Row {} of Excel table is empty.'.format(xls_row))
-        else:
-            new_smm_row = []
-            for common_field in common_fields:
-                xls_col = xls_head_col_dict[common_field]
-                value = sheet["{}{}".format(xls_col, xls_row)].value
-                logger.debug("Excel sheet cell {}{} has value {}".format(xls_col, xls_row, value))
-                # Currently the Scanned Maps Master feature class only has string, long int and short int fields,
-                # so we will only validate for those field types.
-                if smm_field_dict[common_field]['TYPE'] == 'SmallInteger':
-                    if value in ['', None]:
-                        new_smm_row.append(None)
-                    else:
-                        try:
-                            x = int(value)
-                            if -32768 <= value <= 32767:
-                                new_smm_row.append(int(value))
-                            else:
-                                new_smm_row.append(None)
-                                invalid_values.append("{}{}".format(xls_col, xls_row))
-                        except:
-                            new_smm_row.append(None)
-                            invalid_values.append("{}{}".format(xls_col, xls_row))
-                elif smm_field_dict[common_field]['TYPE'] == 'Integer':
-                    if value in ['', None]:
-                        new_smm_row.append(None)
-                    else:
-                        try:
-                            x = int(value)
-                            if -2147483648 <= value <= 2147483647:
-                                new_smm_row.append(int(value))
-                            else:
-                                new_smm_row.append(None)
-                                invalid_values.append("{}{}".format(xls_col, xls_row))
-                        except:
-                            new_smm_row.append(None)
-                            invalid_values.append("{}{}".format(xls_col, xls_row))
-                elif smm_field_dict[common_field]['TYPE'] == 'String':
-                    if value in ['', None]:
-                        new_smm_row.append('')
-                    elif len(str(value)) <= smm_field_dict[common_field]['LENGTH']:
-                        new_smm_row.append(str(value))
-                    else:
-                        new_smm_row.append(None)
-                        invalid_values.append("{}{}".format(xls_col, xls_row))
-
-            logger.debug('New row will look like {}'.format(new_smm_row))
-            # Now grab the geometry from the dictionary mapsh_geom_dict[mapsh][0] (it's a list of one geometry object)
-            mapsh_col = xls_head_col_dict['MAPSH_LST']
-            value = str(sheet['{}{}'.format(mapsh_col, xls_row)].value).replace('None', '').replace(' ', '')
-            if ',' not in value:
-                mapsh_geom = mapsh_geom_dict[value][0]
-            else:
-                mapsh_geom = mapsh_geom_dict[value.split(',')[0]][0]
-                for mapsh in value.split(',')[1:]:
-                    mapsh_geom = mapsh_geom.union(mapsh_geom_dict[mapsh][0])
 
-            new_smm_row.append(mapsh_geom)
-            new_smm_rows.append(new_smm_row)
-        logger.debug('Processed {} rows of Excel table'.format(xls_row))
+    common_col_letters = [get_column_letter(xls_head_col_dict[common_field] + 1) for common_field in common_fields]
+
+    # Validate the Excel table a column at a time. Currently the Scanned Maps Master feature class only has string,
+    # long int and short int fields, so we will only validate for those field types and pass any other values
+    # through as they are. Geometries are only looked up once every row has passed, as each feature is inserted.
+    logger.info('Building new rows from Excel table')
+    new_smm_df = pd.DataFrame(index=data_df.index, columns=common_fields, dtype=object)
+    invalid_df = pd.DataFrame(index=data_df.index, columns=common_col_letters, dtype=bool)
+    for common_field, xls_col in zip(common_fields, common_col_letters):
+        validator = FIELD_VALIDATORS.get(smm_field_dict[common_field]['TYPE'], validate_unchecked)
+        new_smm_df[common_field], invalid_df[xls_col] = validator(data_df[xls_head_col_dict[common_field]],
+                                                                  smm_field_dict[common_field]['LENGTH'])
+    # list the invalid cells row by row
+    invalid_rows, invalid_cols = np.nonzero(invalid_df.to_numpy(dtype=bool))
+    invalid_values = ["{}{}".format(invalid_df.columns[col], invalid_df.index[row])
+                      for row, col in zip(invalid_rows, invalid_cols)]
 
     if len(invalid_values) > 0:
         if len(invalid_values) > 0:
@@ -320,13 +354,65 @@ def append_scanned_maps(input_xls, smm_fc, mg_fc, logger):
                     str(invalid_values).replace('[', '').replace(']', '').replace("'", '')))
         sys.exit(100)
 
-    icursor = arcpy.da.InsertCursor(smm_fc, cfl)
+    # With many distinct multi-tile lists, union them across worker processes before inserting. Geometries are passed
+    # to and from the workers as WKB, and each result is kept as WKB only until the first row that uses it. Starting
+    # arcpy in each worker takes a few seconds, so smaller workbooks are unioned in this process as each row is
+    # inserted.
+    parallel_unions = {}
+    multi_tile_keys = sorted({mapsh_key for mapsh_key in mapsh_keys if len(mapsh_key) > 1})
+    if len(multi_tile_keys) >= PARALLEL_UNION_MIN_KEYS:
+        logger.info('Unioning {} distinct lists of mapsheets in parallel'.format(len(multi_tile_keys)))
+        mp_context = multiprocessing.get_context('spawn')
+        # in ArcGIS Pro sys.executable is the application rather than the Python interpreter
+        if os.name == 'nt':
+            mp_context.set_executable(os.path.join(sys.exec_prefix, 'python.exe'))
+        spatial_reference_string = mg_desc.spatialReference.exportToString()
+        wkb_lists = [[mapsh_geom_dict[mapsh][0].WKB for mapsh in mapsh_key] for mapsh_key in multi_tile_keys]
+        with concurrent.futures.ProcessPoolExecutor(mp_context=mp_context) as executor:
+            parallel_unions = dict(zip(multi_tile_keys, executor.map(
+                union_wkb, wkb_lists, itertools.repeat(spatial_reference_string), chunksize=100)))
+
+    # Rows often share the same mapsheet list, so each distinct (sorted) list of tiles is only unioned once. A union is
+    # only kept while a later row still needs it, so memory is held for repeated lists that are still to be inserted
+    # rather than for every union made.
+    remaining_uses = Counter(mapsh_keys)
+    union_cache = {}
+
+    def union_tiles(mapsh_key):
+        mapsh_geom = union_cache.pop(mapsh_key, None)
+        if mapsh_geom is None:
+            if mapsh_key in parallel_unions:
+                mapsh_geom = arcpy.FromWKB(parallel_unions.pop(mapsh_key), mg_desc.spatialReference)
+            else:
+                mapsh_geom = union_geometries([mapsh_geom_dict[mapsh][0] for mapsh in mapsh_key])
+        remaining_uses[mapsh_key] -= 1
+        if remaining_uses[mapsh_key] > 0:
+            union_cache[mapsh_key] = mapsh_geom
+        return mapsh_geom
+
+    # Insert all rows within one edit session so they are committed as a single transaction (and rolled back together
+    # on failure). The edit session is started on the workspace, not on a feature dataset holding the feature class,
+    # and is only a versioned (multiuser) session when the feature class is registered as versioned.
+    smm_desc = arcpy.Describe(smm_fc)
+    workspace = smm_desc.path
+    if arcpy.Describe(workspace).dataType == 'FeatureDataset':
+        workspace = os.path.dirname(workspace)
     logger.debug('Initiating InsertCursor with the following fields:')
     for f in cfl:
         logger.debug('  - {}'.format(f))
-    logger.info('Inserting {} new rows into Scanned Maps Master feature class.'.format(len(new_smm_rows)))
-    for new_smm_row in new_smm_rows:
-        icursor.insertRow(new_smm_row)
+    logger.info('Inserting {} new rows into Scanned Maps Master feature class.'.format(len(new_smm_df.index)))
+    # itertuples yields nothing for a dataframe without columns, so when no fields are in common each row is
+    # inserted with its geometry only
+    if common_fields:
+        new_smm_rows = new_smm_df.itertuples(index=False, name=None)
+    else:
+        new_smm_rows = itertools.repeat(())
+    editor = arcpy.da.Editor(workspace, multiuser_mode=smm_desc.isVersioned)
+    with editor, arcpy.da.InsertCursor(smm_fc, cfl) as icursor:
+        for new_smm_row, mapsh_key in zip(new_smm_rows, mapsh_keys):
+            logger.debug('New row will look like %s', new_smm_row)
+            # Now grab the geometry from the dictionary mapsh_geom_dict[mapsh][0] (it's a list of one geometry object)
+            icursor.insertRow(list(new_smm_row) + [union_tiles(mapsh_key)])
 
 
 if __name__ == '__main__':